@@ -5,19 +5,59 @@ Copyright (c) 2019 - present AppSeed.us
 
 # Import core packages
 import os
+import logging
+from dotenv import load_dotenv
 
 # Import Flask 
 from flask import Flask
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+load_dotenv()
+
+# App logging: debug output in development, warnings and errors otherwise
+logging.basicConfig(level=logging.WARNING)
+logging.getLogger('app').setLevel(logging.DEBUG if os.getenv('FLASK_ENV') == 'development' else logging.WARNING)
+
+# Sample values that must never sign real sessions
+PLACEHOLDER_SECRET_KEYS = frozenset({'change-me'})
+
+def load_secret_key():
+    """Read a stable session key so every worker and restart signs sessions alike"""
+    key = (os.getenv('FLASK_SECRET_KEY') or '').strip()
+    secret_file = '/run/secrets/flask_secret_key'
+    if not key and os.path.exists(secret_file):
+        with open(secret_file) as f:
+            key = f.read().strip()
+    if os.getenv('FLASK_ENV') == 'development':
+        return key or os.urandom(24)
+    if not key or key in PLACEHOLDER_SECRET_KEYS:
+        raise RuntimeError('FLASK_SECRET_KEY is not set to a real secret')
+    return key
 
 # Inject Flask magic
 app = Flask(__name__)
-app.secret_key = os.urandom(24)
+app.secret_key = load_secret_key()
 
 # Session config
 app.config['SESSION_COOKIE_HTTPONLY'] = True
+app.config['SESSION_COOKIE_SECURE'] = os.getenv('FLASK_ENV') != 'development'
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 app.config['PERMANENT_SESSION_LIFETIME'] = 86400
 
+# Trust X-Forwarded-For from the nginx proxy in front (nginx/appseed-app.conf), so
+# request.remote_addr is the client rather than the proxy; set TRUSTED_PROXIES=0
+# when the app is reached directly
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.getenv('TRUSTED_PROXIES', 1)))
+
+# Rate limiting (per client IP); point RATELIMIT_STORAGE_URI at Redis to share counts across workers
+limiter = Limiter(
+    get_remote_address,
+    app=app,
+    storage_uri=os.getenv('RATELIMIT_STORAGE_URI', 'memory://')
+)
+
 # Import routing to render the pages
 from app import views
 
@@ -0,0 +1,186 @@
+# -*- encoding: utf-8 -*-
+"""
+FMZB Hub - Database Module
+Shared PyMySQL connection pool and background activity-log writer
+"""
+
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from types import MappingProxyType
+from contextlib import contextmanager
+
+import pymysqlpool
+from pymysql.cursors import DictCursor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# ===== CONFIG =====
+
+# Read once at import; the environment does not change after startup
+DB_CONFIG = MappingProxyType(dict(
+    host=os.getenv('DB_HOST', 'mysql'),
+    port=int(os.getenv('DB_PORT', 3309)),
+    user=os.getenv('DB_USER', 'root'),
+    password=os.getenv('DB_PASSWORD', 'change-me'),
+    database=os.getenv('DB_NAME', 'BIT 4444 Group Project'),
+    charset='utf8mb4',
+    cursorclass=DictCursor,
+    autocommit=True
+))
+
+# ===== CONNECTION POOL =====
+
+# Connections per worker process; keep workers * DB_POOL_MAXSIZE under MySQL's max_connections
+DB_POOL_MAXSIZE = int(os.getenv('DB_POOL_MAXSIZE', 32))
+# Seconds a request waits for a free connection before giving up
+DB_POOL_WAIT = 5
+
+# One pool per process, built on first use so the preloading gunicorn master
+# never opens connections and a MySQL outage at boot does not break import
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+# One slot per connection: a gevent worker has far more requests in flight than the
+# pool has connections, and the pool itself raises instead of waiting when it is full
+_pool_slots = None
+
+def get_pool():
+    """Return this process's pool, building it on first use (and again after a fork)"""
+    global _pool, _pool_pid, _pool_slots
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = pymysqlpool.ConnectionPool(
+                    name='fmzb',
+                    size=10,
+                    maxsize=DB_POOL_MAXSIZE,
+                    pre_create_num=5,
+                    **DB_CONFIG
+                )
+                _pool_slots = threading.BoundedSemaphore(DB_POOL_MAXSIZE)
+                _pool_pid = pid
+    return _pool
+
+@contextmanager
+def get_conn():
+    """Borrow a pooled connection; it is handed back to the pool on exit"""
+    pool = get_pool()
+    slots = _pool_slots
+    # Queue here (cooperatively under gevent) until a connection is free
+    if not slots.acquire(timeout=DB_POOL_WAIT):
+        raise pymysqlpool.GetConnectionFromPoolError(f'no free database connection after {DB_POOL_WAIT}s')
+    try:
+        # Holding a slot guarantees room, so open a new connection rather than
+        # retrying; pre_ping refreshes connections MySQL dropped after wait_timeout
+        conn = pool.get_connection(retry_num=0, pre_ping=True)
+        try:
+            yield conn
+        finally:
+            conn.close()
+    finally:
+        slots.release()
+
+# ===== ACTIVITY LOG =====
+
+ACTIVITY_BATCH_SIZE = 128
+ACTIVITY_FLUSH_INTERVAL = 0.25
+
+# Rows are (Email, ActivityType, ActivityDescription); ActivityDate defaults to NOW()
+_activity_queue = queue.Queue(maxsize=10000)
+_writer_thread = None
+_writer_lock = threading.Lock()
+
+# Rows taken off the queue but not yet written. The writer holds _pending_lock
+# while it writes, so the exit hook either waits for that write or takes over
+# the rows itself, and never writes a row twice
+_pending = []
+_pending_lock = threading.Lock()
+
+def log_activities(rows):
+    """Insert (Email, ActivityType, ActivityDescription) rows in one multi-row INSERT"""
+    # Keep the plain VALUES (%s, ...) form so PyMySQL rewrites executemany into one statement
+    with get_conn() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT INTO UserActivityLog (Email, ActivityType, ActivityDescription) VALUES (%s, %s, %s)",
+            rows
+        )
+
+def _write_activities(rows):
+    """Write a batch for the background writer, which must never die on a DB error"""
+    try:
+        log_activities(rows)
+        return
+    except Exception as e:
+        if len(rows) == 1:
+            logger.error("Activity log write failed, dropped '%s' for %s: %s", rows[0][1], rows[0][0], e)
+            return
+        logger.warning("Activity log batch of %d failed, retrying row by row: %s", len(rows), e)
+    # One bad row (e.g. an Email that fails the foreign key) must not cost the rest
+    for row in rows:
+        _write_activities([row])
+
+def _write_pending():
+    """Write and clear the rows the writer has collected so far"""
+    with _pending_lock:
+        if _pending:
+            _write_activities(list(_pending))
+            _pending.clear()
+
+def _collect(row):
+    with _pending_lock:
+        _pending.append(row)
+
+def _activity_writer():
+    """Drain the queue, flushing every ACTIVITY_FLUSH_INTERVAL or ACTIVITY_BATCH_SIZE rows"""
+    while True:
+        _collect(_activity_queue.get())
+        collected = 1
+        deadline = time.monotonic() + ACTIVITY_FLUSH_INTERVAL
+        while collected < ACTIVITY_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                _collect(_activity_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+            collected += 1
+        _write_pending()
+
+def _ensure_writer():
+    """Start the writer thread in this process (threads do not survive a fork)"""
+    global _writer_thread
+    if _writer_thread is not None and _writer_thread.is_alive():
+        return
+    with _writer_lock:
+        if _writer_thread is None or not _writer_thread.is_alive():
+            _writer_thread = threading.Thread(target=_activity_writer, name='activity-log-writer', daemon=True)
+            _writer_thread.start()
+
+def log_activity(email, activity_type, description=None):
+    """Queue a UserActivityLog row; the request never waits on the insert"""
+    _ensure_writer()
+    try:
+        _activity_queue.put_nowait((email, activity_type, description))
+    except queue.Full:
+        logger.error("Activity log queue full, dropped '%s' for %s", activity_type, email)
+
+@atexit.register
+def _flush_activities():
+    """Write the writer's in-flight batch and whatever is still queued when the process exits"""
+    with _pending_lock:
+        while True:
+            try:
+                _pending.append(_activity_queue.get_nowait())
+            except queue.Empty:
+                break
+    _write_pending()
@@ -4,38 +4,33 @@ FMZB Hub - Users Module
 Consolidated users blueprint with authentication, profile management, and dashboard
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, make_response, abort
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHash
 from functools import wraps
-import re
 import os
+import re
+import hmac
+import string
+import hashlib
+import threading
 import pymysql
-from pymysql.cursors import DictCursor
-from dotenv import load_dotenv
+from cachetools import TTLCache, cached
 
-load_dotenv()
+from app import limiter
+from app.db import get_conn, log_activity
 
 users_bp = Blueprint('users', __name__, url_prefix='/users')
 
-# ===== DATABASE HELPERS =====
+# ===== QUERIES =====
 
-def get_db():
-    """Get database connection to BIT 4444 Group Project"""
-    try:
-        conn = pymysql.connect(
-            host=os.getenv('DB_HOST', 'mysql'),
-            port=int(os.getenv('DB_PORT', 3309)),
-            user=os.getenv('DB_USER', 'root'),
-            password=os.getenv('DB_PASSWORD', 'change-me'),
-            database=os.getenv('DB_NAME', 'BIT 4444 Group Project'),
-            charset='utf8mb4',
-            cursorclass=DictCursor,
-            autocommit=True
-        )
-        return conn
-    except Exception as e:
-        print(f"[ERROR] DB connection failed: {e}")
-        return None
+# Only the columns each handler reads, instead of SELECT *
+USER_LOGIN_COLS = 'Email, UserType, ContactFirstName, ContactLastName, UPassword, Status'
+USER_PROFILE_COLS = 'Email, UserType, ContactFirstName, ContactLastName, Phone, Website, BusinessName'
+
+USER_LOGIN_SQL = f"SELECT {USER_LOGIN_COLS} FROM UserProfile WHERE Email = %s"
+USER_PROFILE_SQL = f"SELECT {USER_PROFILE_COLS} FROM UserProfile WHERE Email = %s"
 
 # ===== DECORATORS =====
 
@@ -49,29 +44,189 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Shared secret for internal maintenance endpoints; they are disabled when unset
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+def admin_token_required(f):
+    """Allow only internal callers that send the X-Admin-Token header"""
+    # Customer/merchant sessions never qualify, and browsers cannot add the
+    # header to a cross-site request, so the endpoint is not CSRF-able either
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        token = request.headers.get('X-Admin-Token', '')
+        if not ADMIN_TOKEN or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+            abort(404)
+        return f(*args, **kwargs)
+    return decorated_function
+
+def cache_response(max_age):
+    """Let browsers cache a JSON endpoint for max_age seconds and revalidate via ETag"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            response.set_etag(hashlib.blake2b(response.get_data(), digest_size=8).hexdigest())
+            response.headers['Cache-Control'] = f'private, max-age={max_age}'
+            # Turns the response into a bodiless 304 when If-None-Match matches
+            return response.make_conditional(request)
+        return decorated_function
+    return decorator
+
 # ===== VALIDATORS =====
 
+# Translate tables that delete every allowed character, so valid parts translate to ''
+_LOCAL_ALLOWED = str.maketrans('', '', string.ascii_letters + string.digits + '._%+-')
+_DOMAIN_ALLOWED = str.maketrans('', '', string.ascii_letters + string.digits + '.-')
+# Letters are ASCII only, as in the [A-Z] / [a-z] rules these replaced; digits use
+# isdecimal(), which is what \d matched ('É' and '²' do not count)
+_UPPER = frozenset(string.ascii_uppercase)
+_LOWER = frozenset(string.ascii_lowercase)
+_SPECIAL = frozenset('!@#$%^&*(),.?":{}|<>')
+
 def is_valid_email(email):
-    """Validate email format"""
-    return re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', email) is not None
+    """Validate email format: local@domain.tld with a 2+ letter TLD"""
+    if len(email) > 254:
+        return False
+    local, at, domain = email.rpartition('@')
+    if not at or not local or len(local) > 64 or local.translate(_LOCAL_ALLOWED):
+        return False
+    host, dot, tld = domain.rpartition('.')
+    if not dot or not host or host.translate(_DOMAIN_ALLOWED):
+        return False
+    return len(tld) >= 2 and tld.isascii() and tld.isalpha()
 
 def is_strong_password(password):
     """Validate password strength: 8+ chars, 1 upper, 1 lower, 1 digit, 1 special"""
     if len(password) < 8:
         return False, "Password must be at least 8 characters"
-    if not re.search(r'[A-Z]', password):
+    
+    # Single pass over the password instead of one regex scan per rule
+    has_upper = has_lower = has_digit = has_special = False
+    for ch in password:
+        if ch in _UPPER:
+            has_upper = True
+        elif ch in _LOWER:
+            has_lower = True
+        elif ch.isdecimal():
+            has_digit = True
+        elif ch in _SPECIAL:
+            has_special = True
+    
+    if not has_upper:
         return False, "Must contain uppercase letter"
-    if not re.search(r'[a-z]', password):
+    if not has_lower:
         return False, "Must contain lowercase letter"
-    if not re.search(r'\d', password):
+    if not has_digit:
         return False, "Must contain digit"
-    if not re.search(r'[!@#$%^&*(),.?":{}|<>]', password):
+    if not has_special:
         return False, "Must contain special character"
     return True, "Valid"
 
+# ===== PASSWORD HASHING =====
+
+# Argon2id with OWASP-recommended parameters
+PH = PasswordHasher(time_cost=3, memory_cost=65536, parallelism=4, hash_len=32, salt_len=16)
+
+# Werkzeug hash prefixes from before the switch to Argon2id
+LEGACY_HASH_PREFIXES = ('pbkdf2:', 'scrypt:')
+
+# Under gunicorn's gevent workers a hash would stall every greenlet in the worker
+# (open chat streams included), so it runs on the hub's native threadpool instead;
+# argon2-cffi and hashlib release the GIL while they work
+try:
+    from gevent import get_hub, monkey
+    GEVENT_ACTIVE = monkey.is_module_patched('threading')
+except ImportError:
+    GEVENT_ACTIVE = False
+
+def off_hub(fn, *args):
+    """Run a CPU-heavy call without blocking the gevent hub"""
+    if GEVENT_ACTIVE:
+        return get_hub().threadpool.apply(fn, args)
+    return fn(*args)
+
+def hash_password(password):
+    """Hash a password with Argon2id"""
+    return off_hub(PH.hash, password)
+
+def verify_password(stored_hash, password):
+    """Check a password against its stored hash, returns (matches, needs_rehash)"""
+    if stored_hash.startswith(LEGACY_HASH_PREFIXES):
+        # Legacy Werkzeug hash: always upgrade to Argon2id once it verifies
+        return off_hub(check_password_hash, stored_hash, password), True
+    try:
+        off_hub(PH.verify, stored_hash, password)
+    except (VerificationError, InvalidHash):
+        return False, False
+    return True, PH.check_needs_rehash(stored_hash)
+
+# ===== METRICS =====
+
+# Dashboard counts change slowly; serve them from memory for 30 seconds
+metrics_cache = TTLCache(maxsize=1, ttl=30)
+metrics_cache_lock = threading.Lock()
+
+@cached(metrics_cache, key=lambda: 'metrics', lock=metrics_cache_lock)
+def get_metrics():
+    """Get every KPI count in a single scan of UserProfile"""
+    with get_conn() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT COUNT(*) AS total,
+                   SUM(Status = 'active') AS active,
+                   SUM(Status = 'disabled') AS disabled,
+                   SUM(UserType = 'customer') AS customers,
+                   SUM(UserType = 'merchant') AS merchants,
+                   SUM(UserType = 'customer' AND TimeOfCreation >= DATE_SUB(NOW(), INTERVAL 30 DAY)) AS new_customers
+            FROM UserProfile
+        """)
+        row = cursor.fetchone()
+    
+    # SUM() comes back as Decimal (or NULL on an empty table)
+    return {key: int(value or 0) for key, value in row.items()}
+
+# Whitelisted chat-analysis keywords -> (metrics key, label)
+_KEYWORD_RE = re.compile(r'\b(new customers|active users|merchants|customers|disabled)\b')
+_KEYWORD_METRICS = {
+    'new customers': ('new_customers', 'New customers (30d)'),
+    'active users': ('active', 'Total active users'),
+    'merchants': ('merchants', 'Total merchants'),
+    'customers': ('customers', 'Total customers'),
+    'disabled': ('disabled', 'Disabled accounts'),
+}
+
+# Dashboards poll the recent-users table frequently
+recent_users_cache = TTLCache(maxsize=1, ttl=15)
+recent_users_cache_lock = threading.Lock()
+
+@cached(recent_users_cache, key=lambda: 'recent_users', lock=recent_users_cache_lock)
+def get_recent_users():
+    """Get the ten newest accounts (served from idx_userprofile_created_desc)"""
+    with get_conn() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT Email, UserType, Status, TimeOfCreation, ContactFirstName, ContactLastName
+            FROM UserProfile 
+            ORDER BY TimeOfCreation DESC 
+            LIMIT 10
+        """)
+        return cursor.fetchall()
+
 # ===== ROUTES =====
 
+# Login and registration each run the expensive password hash
+AUTH_RATE_LIMIT = '5/minute'
+
+@users_bp.errorhandler(429)
+def rate_limited(e):
+    """Send throttled form posts back to the form with a message"""
+    flash('Too many attempts. Please wait a minute and try again.', 'warning')
+    return redirect(request.path)
+
 @users_bp.route('/register', methods=['GET', 'POST'])
+@limiter.limit(AUTH_RATE_LIMIT, methods=['POST'])
 def register():
     """UC1: Registration"""
     if request.method == 'GET':
@@ -110,34 +265,25 @@ def register():
             flash(msg, 'danger')
             return redirect(url_for('users.register'))
         
-        # Check if email exists
-        conn = get_db()
-        if not conn:
-            flash('Database error.', 'danger')
-            return redirect(url_for('users.register'))
-        
-        cursor = conn.cursor()
-        cursor.execute("SELECT Email FROM UserProfile WHERE Email = %s", (email,))
-        if cursor.fetchone():
-            conn.close()
-            flash('Email already registered.', 'danger')
-            return redirect(url_for('users.register'))
-        
-        # Create user
-        hashed = generate_password_hash(password)
-        cursor.execute("""
-            INSERT INTO UserProfile 
-            (Email, UserType, ContactFirstName, ContactLastName, UPassword, Phone, Website, BusinessName, Status, TimeOfCreation)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 'active', NOW())
-        """, (email, user_type, first_name, last_name, hashed, phone, website, business_name))
+        # Create user; the Email primary key rejects duplicates
+        hashed = hash_password(password)
+        with get_conn() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("""
+                    INSERT INTO UserProfile 
+                    (Email, UserType, ContactFirstName, ContactLastName, UPassword, Phone, Website, BusinessName, Status, TimeOfCreation)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 'active', NOW())
+                """, (email, user_type, first_name, last_name, hashed, phone, website, business_name))
+            except pymysql.err.IntegrityError as e:
+                if e.args[0] != 1062:
+                    raise
+                flash('Email already registered.', 'danger')
+                return redirect(url_for('users.register'))
         
         # Log activity
-        cursor.execute("""
-            INSERT INTO UserActivityLog (Email, ActivityType, ActivityDate)
-            VALUES (%s, 'Registered', NOW())
-        """, (email,))
+        log_activity(email, 'Registered')
         
-        conn.close()
         flash('Account created! Please log in.', 'success')
         return redirect(url_for('users.login'))
     
@@ -146,6 +292,7 @@ def register():
         return redirect(url_for('users.register'))
 
 @users_bp.route('/login', methods=['GET', 'POST'])
+@limiter.limit(AUTH_RATE_LIMIT, methods=['POST'])
 def login():
     """UC2: Login"""
     if request.method == 'GET':
@@ -155,38 +302,44 @@ def login():
         email = request.form.get('email', '').strip().lower()
         password = request.form.get('password', '')
         
-        conn = get_db()
-        if not conn:
-            flash('Database error.', 'danger')
-            return redirect(url_for('users.login'))
-        
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM UserProfile WHERE Email = %s", (email,))
-        user = cursor.fetchone()
-        
-        if not user or not check_password_hash(user['UPassword'], password):
-            conn.close()
+        # Input that can never match skips both the DB lookup and the hash
+        if not is_valid_email(email) or not 8 <= len(password) <= 1024:
             flash('Invalid email or password.', 'danger')
             return redirect(url_for('users.login'))
         
-        if user['Status'] != 'active':
-            conn.close()
-            flash('Account disabled.', 'warning')
-            return redirect(url_for('users.login'))
-        
-        # Create session
-        session['user_email'] = email
-        session['user_name'] = f"{user['ContactFirstName']} {user['ContactLastName']}"
-        session['user_type'] = user['UserType']
-        session.permanent = True
-        
-        # Update last login
-        cursor.execute("UPDATE UserProfile SET LastLogin = NOW() WHERE Email = %s", (email,))
+        with get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute(USER_LOGIN_SQL, (email,))
+            user = cursor.fetchone()
+            
+            if not user:
+                flash('Invalid email or password.', 'danger')
+                return redirect(url_for('users.login'))
+            
+            valid, needs_rehash = verify_password(user['UPassword'], password)
+            if not valid:
+                flash('Invalid email or password.', 'danger')
+                return redirect(url_for('users.login'))
+            
+            if user['Status'] != 'active':
+                flash('Account disabled.', 'warning')
+                return redirect(url_for('users.login'))
+            
+            # Create session
+            session['user_email'] = email
+            session['user_name'] = f"{user['ContactFirstName']} {user['ContactLastName']}"
+            session['user_type'] = user['UserType']
+            session.permanent = True
+            
+            # Update last login, upgrading the stored hash if it is outdated
+            if needs_rehash:
+                cursor.execute("UPDATE UserProfile SET LastLogin = NOW(), UPassword = %s WHERE Email = %s", (hash_password(password), email))
+            else:
+                cursor.execute("UPDATE UserProfile SET LastLogin = NOW() WHERE Email = %s", (email,))
         
         # Log activity
-        cursor.execute("INSERT INTO UserActivityLog (Email, ActivityType, ActivityDate) VALUES (%s, 'Logged In', NOW())", (email,))
+        log_activity(email, 'Logged In')
         
-        conn.close()
         flash(f'Welcome, {user["ContactFirstName"]}!', 'success')
         return redirect(url_for('users.dashboard'))
     
@@ -201,11 +354,10 @@ def profile():
     email = session.get('user_email')
     
     if request.method == 'GET':
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM UserProfile WHERE Email = %s", (email,))
-        user = cursor.fetchone()
-        conn.close()
+        with get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute(USER_PROFILE_SQL, (email,))
+            user = cursor.fetchone()
         return render_template('users/profile.html', user=user)
     
     try:
@@ -217,9 +369,6 @@ def profile():
         new_password = request.form.get('new_password', '').strip()
         confirm_password = request.form.get('confirm_password', '').strip()
         
-        conn = get_db()
-        cursor = conn.cursor()
-        
         # Update profile fields
         updates = []
         params = []
@@ -240,39 +389,39 @@ def profile():
             updates.append("BusinessName = %s")
             params.append(business_name)
         
-        # Handle password change
-        if new_password:
-            if new_password != confirm_password:
-                conn.close()
-                flash('Passwords do not match.', 'danger')
-                cursor.execute("SELECT * FROM UserProfile WHERE Email = %s", (email,))
-                user = cursor.fetchone()
-                return render_template('users/profile.html', user=user)
+        with get_conn() as conn:
+            cursor = conn.cursor()
             
-            is_valid, msg = is_strong_password(new_password)
-            if not is_valid:
-                conn.close()
-                flash(msg, 'danger')
-                cursor.execute("SELECT * FROM UserProfile WHERE Email = %s", (email,))
-                user = cursor.fetchone()
-                return render_template('users/profile.html', user=user)
+            # Handle password change
+            if new_password:
+                if new_password != confirm_password:
+                    flash('Passwords do not match.', 'danger')
+                    cursor.execute(USER_PROFILE_SQL, (email,))
+                    user = cursor.fetchone()
+                    return render_template('users/profile.html', user=user)
+                
+                is_valid, msg = is_strong_password(new_password)
+                if not is_valid:
+                    flash(msg, 'danger')
+                    cursor.execute(USER_PROFILE_SQL, (email,))
+                    user = cursor.fetchone()
+                    return render_template('users/profile.html', user=user)
+                
+                updates.append("UPassword = %s")
+                params.append(hash_password(new_password))
             
-            updates.append("UPassword = %s")
-            params.append(generate_password_hash(new_password))
+            if updates:
+                params.append(email)
+                sql = f"UPDATE UserProfile SET {', '.join(updates)} WHERE Email = %s"
+                cursor.execute(sql, params)
+                
+                # Log activity
+                log_activity(email, 'Profile Updated')
+                
+                flash('Profile updated.', 'success')
+            else:
+                flash('No changes.', 'info')
         
-        if updates:
-            params.append(email)
-            sql = f"UPDATE UserProfile SET {', '.join(updates)} WHERE Email = %s"
-            cursor.execute(sql, params)
-            
-            # Log activity
-            cursor.execute("INSERT INTO UserActivityLog (Email, ActivityType, ActivityDate) VALUES (%s, 'Profile Updated', NOW())", (email,))
-            
-            flash('Profile updated.', 'success')
-        else:
-            flash('No changes.', 'info')
-        
-        conn.close()
         return redirect(url_for('users.profile'))
     
     except Exception as e:
@@ -286,16 +435,14 @@ def deactivate():
     try:
         email = session.get('user_email')
         
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # Soft delete
-        cursor.execute("UPDATE UserProfile SET Status = 'disabled' WHERE Email = %s", (email,))
+        with get_conn() as conn:
+            cursor = conn.cursor()
+            
+            # Soft delete
+            cursor.execute("UPDATE UserProfile SET Status = 'disabled' WHERE Email = %s", (email,))
         
         # Log activity
-        cursor.execute("INSERT INTO UserActivityLog (Email, ActivityType, ActivityDate) VALUES (%s, 'Deactivated', NOW())", (email,))
-        
-        conn.close()
+        log_activity(email, 'Deactivated')
         session.clear()
         
         flash('Account deactivated.', 'info')
@@ -315,14 +462,7 @@ def dashboard():
 @login_required
 def logout():
     """Logout"""
-    try:
-        email = session.get('user_email')
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO UserActivityLog (Email, ActivityType, ActivityDate) VALUES (%s, 'Logged Out', NOW())", (email,))
-        conn.close()
-    except:
-        pass
+    log_activity(session.get('user_email'), 'Logged Out')
     
     session.clear()
     flash('Logged out.', 'success')
@@ -332,36 +472,25 @@ def logout():
 
 @users_bp.route('/api/metrics', methods=['GET'])
 @login_required
+@cache_response(30)
 def metrics():
     """Get KPI metrics"""
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT COUNT(*) as total FROM UserProfile")
-        total = cursor.fetchone()['total']
-        
-        cursor.execute("SELECT COUNT(*) as active FROM UserProfile WHERE Status = 'active'")
-        active = cursor.fetchone()['active']
-        
-        cursor.execute("SELECT COUNT(*) as disabled FROM UserProfile WHERE Status = 'disabled'")
-        disabled = cursor.fetchone()['disabled']
-        
-        conn.close()
-        return jsonify({'total': total, 'active': active, 'disabled': disabled})
+        kpis = get_metrics()
+        return jsonify({'total': kpis['total'], 'active': kpis['active'], 'disabled': kpis['disabled']})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @users_bp.route('/api/charts/roles', methods=['GET'])
 @login_required
+@cache_response(30)
 def charts_roles():
     """Get chart data for FusionCharts"""
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT UserType, COUNT(*) as cnt FROM UserProfile GROUP BY UserType")
-        rows = cursor.fetchall()
-        conn.close()
+        with get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT UserType, COUNT(*) as cnt FROM UserProfile GROUP BY UserType")
+            rows = cursor.fetchall()
         
         categories = [{'label': row['UserType'].capitalize()} for row in rows]
         dataset = [{'value': row['cnt']} for row in rows]
@@ -372,20 +501,11 @@ def charts_roles():
 
 @users_bp.route('/api/recent-users', methods=['GET'])
 @login_required
+@cache_response(30)
 def recent_users():
     """Get recent users for dashboard table"""
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT Email, UserType, Status, TimeOfCreation, ContactFirstName, ContactLastName
-            FROM UserProfile 
-            ORDER BY TimeOfCreation DESC 
-            LIMIT 10
-        """)
-        users = cursor.fetchall()
-        conn.close()
-        return jsonify(users)
+        return jsonify(get_recent_users())
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -401,33 +521,18 @@ def chat_analyze():
         if not question:
             return jsonify({'error': 'No question'}), 400
         
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # Whitelisted queries
-        queries = {
-            'new customers': ('SELECT COUNT(*) as cnt FROM UserProfile WHERE UserType="customer" AND TimeOfCreation >= DATE_SUB(NOW(), INTERVAL 30 DAY)', 'New customers (30d)'),
-            'active users': ('SELECT COUNT(*) as cnt FROM UserProfile WHERE Status="active"', 'Total active users'),
-            'merchants': ('SELECT COUNT(*) as cnt FROM UserProfile WHERE UserType="merchant"', 'Total merchants'),
-            'customers': ('SELECT COUNT(*) as cnt FROM UserProfile WHERE UserType="customer"', 'Total customers'),
-            'disabled': ('SELECT COUNT(*) as cnt FROM UserProfile WHERE Status="disabled"', 'Disabled accounts'),
-        }
-        
         result = None
         label = 'Not found'
         
-        for keyword, (sql, desc) in queries.items():
-            if keyword in question:
-                cursor.execute(sql)
-                row = cursor.fetchone()
-                result = row['cnt'] if row else 0
-                label = desc
-                break
+        # Match a whitelisted keyword and answer from the cached KPI counts
+        match = _KEYWORD_RE.search(question)
+        if match:
+            metric, label = _KEYWORD_METRICS[match.group(1)]
+            result = get_metrics()[metric]
         
         # Log activity
-        cursor.execute("INSERT INTO UserActivityLog (Email, ActivityType, ActivityDescription, ActivityDate) VALUES (%s, 'Analysis', %s, NOW())", (email, question))
+        log_activity(email, 'Analysis', question)
         
-        conn.close()
         
         if result is not None:
             return jsonify({'answer': f'{label}: {result}', 'value': result, 'label': label})
@@ -4,21 +4,24 @@ Copyright (c) 2019 - present AppSeed.us
 """
 
 # Flask modules
-from flask   import render_template, request, redirect, url_for, flash, jsonify
+from flask   import render_template, request, redirect, url_for, flash, jsonify, Response
 from jinja2  import TemplateNotFound
 import os
 import json
+import logging
+import functools
+import threading
+from itertools import groupby
+from operator import itemgetter
 from dotenv import load_dotenv
-
-# Database imports
-import pymysql
-from pymysql.cursors import DictCursor
+from cachetools import TTLCache, cached
 
 # Load environment variables from .env file
 load_dotenv()
 
 # OpenAI imports
 try:
+    import httpx
     from openai import OpenAI
     OPENAI_AVAILABLE = True
 except ImportError:
@@ -26,63 +29,84 @@ except ImportError:
 
 # App modules
 from app import app
+from app.db import get_conn, DB_CONFIG
+from app.users import admin_token_required, cache_response
 # from app.models import Profiles
 
+logger = logging.getLogger(__name__)
+
+# Settings read once at import instead of on every request
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+OPENAI_API_BASE = os.getenv('OPENAI_API_BASE')
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
+DB_NAME = DB_CONFIG['database']
+
 # Initialize OpenAI client with custom base URL and model if available
+# One HTTP/2 keep-alive client is shared by every chat request
 openai_client = None
 if OPENAI_AVAILABLE:
-    api_key = os.getenv('OPENAI_API_KEY')
-    api_base = os.getenv('OPENAI_API_BASE')
-    if api_key:
+    if OPENAI_API_KEY:
         openai_client = OpenAI(
-            api_key=api_key,
-            base_url=api_base
+            api_key=OPENAI_API_KEY,
+            base_url=OPENAI_API_BASE,
+            http_client=httpx.Client(
+                http2=True,
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+                timeout=30
+            )
         )
 
-# Database connection helper
-def get_db_connection():
-    """Create and return a connection to BIT 4444 Group Project database"""
-    try:
-        conn = pymysql.connect(
-            host=os.getenv('DB_HOST', 'mysql'),
-            port=int(os.getenv('DB_PORT', 3309)),
-            user=os.getenv('DB_USER', 'root'),
-            password=os.getenv('DB_PASSWORD', 'change-me'),
-            database=os.getenv('DB_NAME', 'BIT 4444 Group Project'),
-            charset='utf8mb4',
-            cursorclass=DictCursor,
-            autocommit=True
-        )
-        return conn
-    except Exception as e:
-        print(f"Database connection error: {e}")
-        return None
+# Schema cache: the catalog rarely changes, so keep it in-process for a few minutes
+schema_cache = TTLCache(maxsize=4, ttl=300)
+schema_cache_lock = threading.Lock()
+
+@cached(schema_cache, lock=schema_cache_lock)
+def get_schema(db_name):
+    """Get table names and column info for a schema in a single catalog query"""
+    with get_conn() as conn:
+        cursor = conn.cursor()
+        # Aliased to the keys /api/db-info returns, so rows need no remapping
+        cursor.execute("""
+            SELECT TABLE_NAME, COLUMN_NAME AS `name`, COLUMN_TYPE AS `type`, IS_NULLABLE AS `null`,
+                   COLUMN_KEY AS `key`, COLUMN_DEFAULT AS `default`
+            FROM INFORMATION_SCHEMA.COLUMNS
+            WHERE TABLE_SCHEMA = %s
+            ORDER BY TABLE_NAME, ORDINAL_POSITION
+        """, (db_name,))
+        rows = cursor.fetchall()
+    
+    # Rows arrive sorted by table, so one groupby pass splits them
+    table_info = {}
+    for table, columns in groupby(rows, key=itemgetter('TABLE_NAME')):
+        table_info[table] = [{k: v for k, v in col.items() if k != 'TABLE_NAME'} for col in columns]
+    
+    return list(table_info), table_info
 
 # Helper function to get database schema context for the AI
 def get_database_context():
     """Get database tables and basic schema info for the AI context"""
     context = "Available Northwind database tables: "
     try:
-        conn = get_db_connection()
-        if not conn:
-            return context + "Unable to connect to database."
-        
-        cursor = conn.cursor()
-        # Get all table names
-        cursor.execute("""
-            SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES 
-            WHERE TABLE_SCHEMA = %s
-        """, (os.getenv('DB_NAME', 'northwind'),))
-        
-        tables = [row['TABLE_NAME'] for row in cursor.fetchall()]
+        tables, _ = get_schema(DB_NAME)
         context += ", ".join(tables) if tables else "No tables found"
-        
-        conn.close()
     except Exception as e:
         context += f"(Error retrieving schema: {str(e)})"
     
     return context
 
+SYSTEM_PROMPT = """You are a helpful assistant with access to a Northwind database.
+You can answer questions about products, customers, orders, suppliers, employees, and more.
+
+{db_context}
+
+When users ask about data, you can help them understand the database or suggest SQL queries.
+Be friendly and helpful in your responses."""
+
+@functools.lru_cache(maxsize=4)
+def get_system_message(db_context):
+    """Render the system message once per distinct schema context"""
+    return {"role": "system", "content": SYSTEM_PROMPT.format(db_context=db_context)}
+
 # App main route + generic routing
 @app.route('/')
 def index():
@@ -100,7 +124,7 @@ def ai_chat():
 
 @app.route('/api/chat', methods=['POST'])
 def chat_api():
-    """Handle chat messages and call OpenAI API with Northwind database context"""
+    """Handle chat messages and stream the OpenAI reply with Northwind database context"""
     try:
         # Check if OpenAI is configured
         if not openai_client:
@@ -112,44 +136,32 @@ def chat_api():
         if not user_message:
             return jsonify({'error': 'Empty message'}), 400
         
-        # Get model from environment or use default
-        model = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
+        model = OPENAI_MODEL
         
-        # Get database context for the AI
-        db_context = get_database_context()
-        
-        # Build system prompt with database info
-        system_prompt = f"""You are a helpful assistant with access to a Northwind database.
-You can answer questions about products, customers, orders, suppliers, employees, and more.
-
-{db_context}
-
-When users ask about data, you can help them understand the database or suggest SQL queries.
-Be friendly and helpful in your responses."""
+        # System prompt with database info; re-rendered only when the schema context changes
+        system_message = get_system_message(get_database_context())
         
-        # Debug: Print connection info (remove in production)
-        print(f"[DEBUG] Using model: {model}")
-        print(f"[DEBUG] API Base: {os.getenv('OPENAI_API_BASE')}")
-        print(f"[DEBUG] User message: {user_message}")
+        # Lazy %s formatting: nothing is built unless debug logging is on
+        logger.debug('Using model: %s', model)
+        logger.debug('API Base: %s', OPENAI_API_BASE)
+        logger.debug('User message: %s', user_message)
         
-        # Call OpenAI API
+        # Call OpenAI API; HTTP errors surface here, before any bytes are sent
         try:
-            response = openai_client.chat.completions.create(
+            stream = openai_client.chat.completions.create(
                 model=model,
                 messages=[
-                    {"role": "system", "content": system_prompt},
+                    system_message,
                     {"role": "user", "content": user_message}
                 ],
                 temperature=0.7,
-                max_tokens=500
+                max_tokens=500,
+                stream=True
             )
-            
-            reply = response.choices[0].message.content
-            return jsonify({'reply': reply})
         
         except Exception as api_error:
             error_msg = str(api_error)
-            print(f"[ERROR] OpenAI API call failed: {error_msg}")
+            logger.error('OpenAI API call failed: %s', error_msg)
             
             # Check for common auth errors
             if "401" in error_msg or "Unauthorized" in error_msg:
@@ -164,9 +176,26 @@ Be friendly and helpful in your responses."""
                 }), 404
             else:
                 return jsonify({'error': f'API Error: {error_msg}'}), 500
+        
+        # Relay the completion to the browser as server-sent events
+        def generate():
+            try:
+                for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield f"data: {json.dumps({'delta': chunk.choices[0].delta.content})}\n\n"
+            except Exception as stream_error:
+                logger.error('OpenAI stream failed: %s', stream_error)
+                yield f"data: {json.dumps({'error': f'API Error: {stream_error}'})}\n\n"
+            finally:
+                stream.response.close()
+        
+        return Response(generate(), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
     
     except Exception as e:
-        print(f"[ERROR] Chat endpoint error: {e}")
+        logger.error('Chat endpoint error: %s', e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/query', methods=['POST'])
@@ -183,15 +212,10 @@ def query_database():
         if not sql_query.upper().startswith('SELECT'):
             return jsonify({'error': 'Only SELECT queries are allowed'}), 400
         
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': 'Database connection failed'}), 500
-        
-        cursor = conn.cursor()
-        cursor.execute(sql_query)
-        results = cursor.fetchall()
-        
-        conn.close()
+        with get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_query)
+            results = cursor.fetchall()
         
         return jsonify({'results': results, 'count': len(results)})
     
@@ -200,43 +224,22 @@ def query_database():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/db-info', methods=['GET'])
+@cache_response(600)
 def db_info():
     """Get database schema and table information"""
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': 'Database connection failed'}), 500
-        
-        cursor = conn.cursor()
-        
-        # Get all tables
-        cursor.execute("""
-            SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES 
-            WHERE TABLE_SCHEMA = %s
-        """, (os.getenv('DB_NAME', 'northwind'),))
-        
-        tables = [row['TABLE_NAME'] for row in cursor.fetchall()]
-        
-        # Get table info
-        table_info = {}
-        for table in tables:
-            cursor.execute(f"DESCRIBE {table}")
-            columns = cursor.fetchall()
-            table_info[table] = [
-                {
-                    'name': col.get('Field'),
-                    'type': col.get('Type'),
-                    'null': col.get('Null'),
-                    'key': col.get('Key'),
-                    'default': col.get('Default')
-                }
-                for col in columns
-            ]
-        
-        conn.close()
+        tables, table_info = get_schema(DB_NAME)
         
         return jsonify({'tables': tables, 'schema': table_info})
     
     except Exception as e:
         print(f"DB info error: {e}")
         return jsonify({'error': str(e)}), 500
+
+@app.route('/admin/flush-schema', methods=['POST'])
+@admin_token_required
+def flush_schema():
+    """Drop the cached schema so the next request re-reads the catalog"""
+    with schema_cache_lock:
+        schema_cache.clear()
+    return jsonify({'flushed': True})
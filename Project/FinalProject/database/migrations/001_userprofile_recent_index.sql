@@ -0,0 +1,10 @@
+-- ===== FMZB Hub Module 1 - UserProfile recent-users index =====
+-- Apply to databases created before this index was added to schema.sql.
+
+-- Covering index for the dashboard's "recent users" query: the newest rows
+-- are read straight off the index without sorting or touching the table.
+CREATE INDEX idx_userprofile_created_desc
+    ON UserProfile (TimeOfCreation DESC, UserType, Status, ContactFirstName, ContactLastName);
+
+-- Superseded by the index above (same leading column)
+DROP INDEX idx_created ON UserProfile;
@@ -19,7 +19,7 @@ CREATE TABLE UserProfile (
     LastLogin DATETIME NULL,
     INDEX idx_status (Status),
     INDEX idx_type (UserType),
-    INDEX idx_created (TimeOfCreation)
+    INDEX idx_userprofile_created_desc (TimeOfCreation DESC, UserType, Status, ContactFirstName, ContactLastName)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- UserActivityLog Table
@@ -37,6 +37,7 @@ CREATE TABLE UserActivityLog (
 
 -- ===== SEED DATA FOR TESTING =====
 -- Note: Passwords are hashed with werkzeug. These are examples of what would be hashed.
+-- New accounts are hashed with Argon2id; werkzeug hashes are upgraded on the next login.
 -- DO NOT use in production without proper password hashing.
 
 -- Customer 1: John Smith (password: SecurePass123!)
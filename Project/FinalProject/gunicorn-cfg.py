@@ -3,8 +3,21 @@
 Copyright (c) 2019 - present AppSeed.us
 """
 
+# Patch before the app is preloaded so its locks, queues and sockets are all cooperative
+from gevent import monkey
+monkey.patch_all()
+
+import multiprocessing
+
 bind = '0.0.0.0:5005'
-workers = 1
+workers = (2 * multiprocessing.cpu_count()) + 1
+# Each worker multiplexes many slow OpenAI streams instead of parking a thread per chat
+worker_class = 'gevent'
+# Requests in flight per worker; database work queues on app.db's DB_POOL_MAXSIZE
+# connections, and password hashing runs on the hub's threadpool
+worker_connections = 1000
+keepalive = 30
+preload_app = True
 accesslog = '-'
 loglevel = 'debug'
 capture_output = True
@@ -5,92 +5,345 @@ Uses PyMySQL with parameterized queries to avoid SQL injection.
 """
 
 import os
+import base64
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+from datetime import datetime
 from decimal import Decimal
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
 
 import pymysql
-from pymysql.cursors import DictCursor
+import pymysqlpool
+from cachetools import TTLCache
+from pymysql.cursors import Cursor, DictCursor, SSDictCursor
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 DB_NAME = os.getenv("DB_NAME", "BIT 4444 Group Project")
 
+# Rows per multi-row INSERT; keeps each statement well under max_allowed_packet
+BULK_CHUNK_SIZE = 1000
 
-def get_db():
-    """Create and return a new database connection."""
-    return pymysql.connect(
-        host=os.getenv("DB_HOST", "mysql"),
-        port=int(os.getenv("DB_PORT", 3309)),
-        user=os.getenv("DB_USER", "root"),
-        password=os.getenv("DB_PASSWORD", "change-me"),
-        database=DB_NAME,
-        charset="utf8mb4",
-        cursorclass=DictCursor,
-        autocommit=True,
+# MySQL error codes handled below
+ER_DUP_ENTRY = 1062
+ER_NO_SUCH_TABLE = 1146
+
+# Fixed SQL for the hot single-row helpers, built once rather than per call
+_SKU_EXISTS_SQL = "SELECT 1 FROM product WHERE SKU = %s LIMIT 1"
+_SKU_EXISTS_EXCLUDING_SQL = "SELECT 1 FROM product WHERE SKU = %s AND product_id <> %s LIMIT 1"
+_FETCH_PRODUCT_SQL = "SELECT * FROM product WHERE product_id = %s"
+_ARCHIVE_PRODUCT_SQL = "UPDATE product SET archived = 1, updated_at = NOW() WHERE product_id = %s"
+
+
+class DuplicateSKU(Exception):
+    """Raised by insert/update when another product already uses the SKU."""
+
+    def __init__(self, sku: str):
+        super().__init__(f"SKU already exists: {sku}")
+        self.sku = sku
+
+
+# Per-category totals of active stock, kept current by the mutators in this module.
+# NULL categories are stored as '' because the column is the primary key.
+CATEGORY_VALUE_DDL = """
+    CREATE TABLE IF NOT EXISTS category_inventory_value (
+        category VARCHAR(100) NOT NULL PRIMARY KEY,
+        total_value DECIMAL(18,2) NOT NULL DEFAULT 0,
+        product_count INT NOT NULL DEFAULT 0
     )
+"""
+_BUMP_CATEGORY_VALUE_SQL = """
+    INSERT INTO category_inventory_value (category, total_value, product_count)
+    VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE total_value = total_value + %s, product_count = product_count + %s
+"""
+# Columns update_product writes, in the order its UPDATE binds them
+_PRODUCT_FIELDS = ("SKU", "title", "category", "price", "quantity", "description", "image_url")
+_LOCK_PRODUCT_SQL = (
+    f"SELECT {', '.join(_PRODUCT_FIELDS)}, archived FROM product WHERE product_id = %s FOR UPDATE"
+)
+# Server-side timestamp defaults (see ensure_timestamp_defaults) cover writes made
+# outside this module; the statements here still set the columns themselves.
+_TIMESTAMP_COLUMNS_SQL = """
+    SELECT COLUMN_NAME, DATA_TYPE, COLUMN_TYPE, DATETIME_PRECISION,
+           IS_NULLABLE, COLUMN_DEFAULT, COLUMN_COMMENT, EXTRA
+    FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = %s AND TABLE_NAME = 'product'
+      AND COLUMN_NAME IN ('created_at', 'updated_at')
+"""
+
+
+# Short-lived per-process read caches; every write in this module invalidates them.
+# Writes made by other processes become visible once the entry expires.
+_PRODUCT_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=30)
+_SKU_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=30)
+_CACHE_LOCK = threading.Lock()
+
+
+def _invalidate_product(product_id: int, sku_changed: bool = False) -> None:
+    with _CACHE_LOCK:
+        _PRODUCT_CACHE.pop(product_id, None)
+        if sku_changed:
+            _SKU_CACHE.clear()
+
+
+# Connection settings, read once; the environment does not change after startup
+_CONN_KWARGS = dict(
+    host=os.getenv("DB_HOST", "mysql"),
+    port=int(os.getenv("DB_PORT", 3309)),
+    user=os.getenv("DB_USER", "root"),
+    password=os.getenv("DB_PASSWORD", "change-me"),
+    database=DB_NAME,
+    charset="utf8mb4",
+    cursorclass=DictCursor,
+    autocommit=True,
+)
+
+_POOL: Optional[pymysqlpool.ConnectionPool] = None
+_POOL_PID: Optional[int] = None
+_POOL_LOCK = threading.Lock()
+
+
+def _get_pool() -> pymysqlpool.ConnectionPool:
+    """Return this process's connection pool, building it on first use (and after a fork)."""
+    global _POOL, _POOL_PID
+    pid = os.getpid()
+    if _POOL is None or _POOL_PID != pid:
+        with _POOL_LOCK:
+            if _POOL is None or _POOL_PID != pid:
+                _POOL = pymysqlpool.ConnectionPool(
+                    name="fmzb-products",
+                    size=10,
+                    maxsize=20,
+                    pre_create_num=5,
+                    **_CONN_KWARGS,
+                )
+                _POOL_PID = pid
+    return _POOL
+
+
+def get_db():
+    """
+    Borrow a pooled database connection.
+    Calling close() on it hands it back to the pool instead of disconnecting.
+    """
+    # pymysql-pool 0.5 API (pinned in Project/FinalProject/requirements.txt): waits
+    # up to retry_num * retry_interval for a free connection
+    return _get_pool().get_connection(retry_num=10, retry_interval=0.2, pre_ping=True)
+
+
+@contextmanager
+def _transaction(conn):
+    """Run the enclosed statements as one transaction on an autocommit connection."""
+    conn.begin()
+    try:
+        yield
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _bump_category_value(cur, category: Optional[str], value: Decimal, count: int) -> None:
+    """Add value/count (negative to subtract) to a category's summary row."""
+    cur.execute(_BUMP_CATEGORY_VALUE_SQL, (category or "", value, count, value, count))
+
+
+def _rebuild_category_value(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute(CATEGORY_VALUE_DDL)
+        with _transaction(conn):
+            cur.execute("DELETE FROM category_inventory_value")
+            cur.execute(
+                """
+                INSERT INTO category_inventory_value (category, total_value, product_count)
+                SELECT COALESCE(category, ''), COALESCE(SUM(price * quantity), 0), COUNT(*)
+                FROM product
+                WHERE archived = 0
+                GROUP BY COALESCE(category, '')
+                """
+            )
+
+
+def _ensure_category_value(conn) -> None:
+    """Create and backfill the category summary the first time it is missing."""
+    if not _table_exists(conn, "category_inventory_value"):
+        _rebuild_category_value(conn)
+        reset_table_cache()
+
+
+def rebuild_category_inventory_value() -> None:
+    """Recompute the category summary from product (e.g. after writes made outside this module)."""
+    conn = get_db()
+    try:
+        _rebuild_category_value(conn)
+        reset_table_cache()
+    finally:
+        conn.close()
 
 
 def sku_exists(sku: str, exclude_product_id: Optional[int] = None) -> bool:
-    """Check if a SKU already exists (optionally excluding one product)."""
+    """
+    Check if a SKU already exists (optionally excluding one product).
+    Only a hint for forms once uq_product_sku exists: the mutators then raise
+    DuplicateSKU, so writes need not call this first. ensure_indexes() raises
+    if existing duplicates keep that index from being created.
+    """
+    key = (sku, exclude_product_id)
+    with _CACHE_LOCK:
+        cached = _SKU_CACHE.get(key)
+    if cached is not None:
+        return cached
+
     conn = get_db()
     try:
-        with conn.cursor() as cur:
+        # Plain tuple cursor: only the presence of a row matters
+        with conn.cursor(Cursor) as cur:
             if exclude_product_id:
-                cur.execute(
-                    "SELECT 1 FROM product WHERE SKU = %s AND product_id <> %s LIMIT 1",
-                    (sku, exclude_product_id),
-                )
+                cur.execute(_SKU_EXISTS_EXCLUDING_SQL, (sku, exclude_product_id))
             else:
-                cur.execute("SELECT 1 FROM product WHERE SKU = %s LIMIT 1", (sku,))
-            return cur.fetchone() is not None
+                cur.execute(_SKU_EXISTS_SQL, (sku,))
+            exists = cur.fetchone() is not None
     finally:
         conn.close()
 
+    with _CACHE_LOCK:
+        _SKU_CACHE[key] = exists
+    return exists
+
+
+def _as_decimal(value) -> Decimal:
+    # Via str so a float gives its printed value, not its binary expansion
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+
+def _as_int(value) -> int:
+    return value if type(value) is int else int(value)
+
+
+@contextmanager
+def _unique_sku(sku: Optional[str]):
+    """Turn a duplicate-key error from uq_product_sku into DuplicateSKU."""
+    try:
+        yield
+    except pymysql.err.IntegrityError as e:
+        if e.args[0] == ER_DUP_ENTRY:
+            raise DuplicateSKU(sku) from e
+        raise
+
+
+def _insert_product(cur, payload: Dict) -> int:
+    price = _as_decimal(payload.get("price"))
+    quantity = _as_int(payload.get("quantity"))
+    with _unique_sku(payload.get("SKU")):
+        cur.execute(
+            """
+            INSERT INTO product (
+                SKU, title, category, price, quantity,
+                description, image_url, archived, is_sold, created_at, updated_at
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, 0, 0, NOW(), NOW())
+            """,
+            (
+                payload.get("SKU"),
+                payload.get("title"),
+                payload.get("category"),
+                price,
+                quantity,
+                payload.get("description"),
+                payload.get("image_url"),
+            ),
+        )
+    product_id = cur.lastrowid
+    _bump_category_value(cur, payload.get("category"), price * quantity, 1)
+    return product_id
+
 
 def insert_product(payload: Dict) -> int:
-    """Insert a new product and return its primary key."""
+    """Insert a new product and return its primary key; raises DuplicateSKU if the SKU is taken."""
+    conn = get_db()
+    try:
+        _ensure_category_value(conn)
+        with conn.cursor() as cur, _transaction(conn):
+            product_id = _insert_product(cur, payload)
+    finally:
+        conn.close()
+    _invalidate_product(product_id, sku_changed=True)
+    return product_id
+
+
+def create_product(payload: Dict) -> Dict:
+    """
+    Insert a new product and return the stored row.
+    Insert and re-read share one connection and cursor, so a caller rendering the
+    new product does not need a separate fetch_product() call.
+    """
     conn = get_db()
     try:
+        _ensure_category_value(conn)
         with conn.cursor() as cur:
-            cur.execute(
-                """
-                INSERT INTO product (
-                    SKU, title, category, price, quantity,
-                    description, image_url, archived, is_sold, created_at, updated_at
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, 0, 0, NOW(), NOW())
-                """,
-                (
-                    payload.get("SKU"),
-                    payload.get("title"),
-                    payload.get("category"),
-                    Decimal(payload.get("price")),
-                    int(payload.get("quantity")),
-                    payload.get("description"),
-                    payload.get("image_url"),
-                ),
-            )
-            return cur.lastrowid
+            with _transaction(conn):
+                product_id = _insert_product(cur, payload)
+            _invalidate_product(product_id, sku_changed=True)
+            cur.execute(_FETCH_PRODUCT_SQL, (product_id,))
+            return cur.fetchone()
     finally:
         conn.close()
 
 
 def fetch_product(product_id: int) -> Optional[Dict]:
     """Return a product by id."""
+    with _CACHE_LOCK:
+        cached = _PRODUCT_CACHE.get(product_id)
+    if cached is not None:
+        # Copy so callers cannot mutate the cached row
+        return dict(cached)
+
     conn = get_db()
     try:
         with conn.cursor() as cur:
-            cur.execute("SELECT * FROM product WHERE product_id = %s", (product_id,))
-            return cur.fetchone()
+            cur.execute(_FETCH_PRODUCT_SQL, (product_id,))
+            row = cur.fetchone()
     finally:
         conn.close()
 
+    if row is not None:
+        with _CACHE_LOCK:
+            _PRODUCT_CACHE[product_id] = dict(row)
+    return row
+
 
 def update_product(product_id: int, payload: Dict) -> None:
-    """Update product fields."""
+    """
+    Update product fields; raises DuplicateSKU if the new SKU is taken.
+    A payload identical to the stored row writes nothing, so updated_at only
+    moves when something really changed.
+    """
+    price = _as_decimal(payload.get("price"))
+    quantity = _as_int(payload.get("quantity"))
+    values = (
+        payload.get("SKU"),
+        payload.get("title"),
+        payload.get("category"),
+        price,
+        quantity,
+        payload.get("description"),
+        payload.get("image_url"),
+    )
     conn = get_db()
     try:
-        with conn.cursor() as cur:
+        _ensure_category_value(conn)
+        with conn.cursor() as cur, _transaction(conn), _unique_sku(payload.get("SKU")):
+            cur.execute(_LOCK_PRODUCT_SQL, (product_id,))
+            old = cur.fetchone()
+            # Compared against the locked row rather than the fetch_product cache,
+            # which may be up to 30s behind writes from other processes.
+            if old and tuple(old[field] for field in _PRODUCT_FIELDS) == values:
+                return
             cur.execute(
                 """
                 UPDATE product
@@ -98,19 +351,14 @@ def update_product(product_id: int, payload: Dict) -> None:
                     description=%s, image_url=%s, updated_at=NOW()
                 WHERE product_id=%s
                 """,
-                (
-                    payload.get("SKU"),
-                    payload.get("title"),
-                    payload.get("category"),
-                    Decimal(payload.get("price")),
-                    int(payload.get("quantity")),
-                    payload.get("description"),
-                    payload.get("image_url"),
-                    product_id,
-                ),
+                values + (product_id,),
             )
+            if old and not old["archived"]:
+                _bump_category_value(cur, old["category"], -(old["price"] * old["quantity"]), -1)
+                _bump_category_value(cur, payload.get("category"), price * quantity, 1)
     finally:
         conn.close()
+    _invalidate_product(product_id, sku_changed=True)
 
 
 def insert_price_history(product_id: int, old_price: Decimal, new_price: Decimal) -> None:
@@ -127,104 +375,254 @@ def insert_price_history(product_id: int, old_price: Decimal, new_price: Decimal
             )
     finally:
         conn.close()
+    _invalidate_product(product_id)
+
+
+def insert_price_history_bulk(rows: List[Tuple[int, Decimal, Decimal]]) -> None:
+    """
+    Log many price changes, given as (product_id, old_price, new_price) tuples.
+    Each chunk is sent as one multi-row INSERT on a single connection.
+    """
+    if not rows:
+        return
+    conn = get_db()
+    try:
+        with conn.cursor() as cur:
+            for start in range(0, len(rows), BULK_CHUNK_SIZE):
+                chunk = rows[start:start + BULK_CHUNK_SIZE]
+                # Built by hand: executemany only batches when VALUES holds bare
+                # placeholders, and change_date needs the server's NOW().
+                values_sql = ", ".join(["(%s, %s, %s, NOW())"] * len(chunk))
+                params = [value for row in chunk for value in row]
+                cur.execute(
+                    "INSERT INTO pricehistory (product_id, old_price, new_price, change_date) "
+                    f"VALUES {values_sql}",
+                    params,
+                )
+    finally:
+        conn.close()
+    for product_id in {row[0] for row in rows}:
+        _invalidate_product(product_id)
 
 
 def archive_product(product_id: int) -> None:
     """Mark a product as archived."""
     conn = get_db()
     try:
-        with conn.cursor() as cur:
-            cur.execute(
-                "UPDATE product SET archived = 1, updated_at = NOW() WHERE product_id = %s",
-                (product_id,),
-            )
+        _ensure_category_value(conn)
+        with conn.cursor() as cur, _transaction(conn):
+            cur.execute(_LOCK_PRODUCT_SQL, (product_id,))
+            old = cur.fetchone()
+            cur.execute(_ARCHIVE_PRODUCT_SQL, (product_id,))
+            if old and not old["archived"]:
+                _bump_category_value(cur, old["category"], -(old["price"] * old["quantity"]), -1)
     finally:
         conn.close()
+    _invalidate_product(product_id)
 
 
-def _table_exists(cursor, table_name: str) -> bool:
-    cursor.execute(
-        """
-        SELECT COUNT(*) AS cnt
-        FROM information_schema.tables
-        WHERE table_schema = %s AND table_name = %s
-        """,
-        (DB_NAME, table_name),
-    )
-    row = cursor.fetchone()
-    return bool(row and row.get("cnt"))
+# Lowercased table names, read once per process; the schema is static while running
+_TABLE_CACHE: Optional[FrozenSet[str]] = None
 
 
-def product_has_open_orders(product_id: int) -> bool:
+def reset_table_cache() -> None:
+    """Forget the cached table names (after a migration, or between tests)."""
+    global _TABLE_CACHE
+    _TABLE_CACHE = None
+
+
+def _tables(conn) -> FrozenSet[str]:
+    global _TABLE_CACHE
+    if _TABLE_CACHE is None:
+        with conn.cursor(Cursor) as cur:
+            cur.execute("SHOW TABLES")
+            _TABLE_CACHE = frozenset(row[0].lower() for row in cur.fetchall())
+    return _TABLE_CACHE
+
+
+def _table_exists(conn, table_name: str) -> bool:
+    return table_name.lower() in _tables(conn)
+
+
+@functools.lru_cache(maxsize=32)
+def _open_orders_sql(count: int) -> str:
+    """Return the query listing which of `count` product ids have open orders."""
+    placeholders = ", ".join(["%s"] * count)
+    return f"""
+        SELECT oi.product_id
+        FROM order_items oi
+        JOIN orders o ON oi.order_id = o.id
+        WHERE oi.product_id IN ({placeholders})
+          AND COALESCE(o.status, 'open') NOT IN ('completed','closed','cancelled')
+        GROUP BY oi.product_id
+    """
+
+
+def products_with_open_orders(product_ids: Iterable[int]) -> Set[int]:
     """
-    Check for open orders referencing a product.
-    Falls back gracefully if order tables are absent.
+    Return the subset of product_ids referenced by open orders.
+    Ids are checked BULK_CHUNK_SIZE at a time on one connection.
+    Falls back gracefully (empty set) if order tables are absent; any other
+    database error propagates.
     """
+    ids = list(dict.fromkeys(product_ids))
+    if not ids:
+        return set()
     conn = get_db()
     try:
-        with conn.cursor() as cur:
-            if not (_table_exists(cur, "orders") and _table_exists(cur, "order_items")):
-                return False
-
-            cur.execute(
-                """
-                SELECT COUNT(*) AS cnt
-                FROM order_items oi
-                JOIN orders o ON oi.order_id = o.id
-                WHERE oi.product_id = %s
-                  AND COALESCE(o.status, 'open') NOT IN ('completed','closed','cancelled')
-                """,
-                (product_id,),
-            )
-            row = cur.fetchone()
-            return bool(row and row.get("cnt"))
-    except Exception:
-        # If the schema differs, do not block the archive.
-        return False
+        found = set()
+        with conn.cursor(Cursor) as cur:
+            for start in range(0, len(ids), BULK_CHUNK_SIZE):
+                chunk = ids[start:start + BULK_CHUNK_SIZE]
+                try:
+                    cur.execute(_open_orders_sql(len(chunk)), chunk)
+                except pymysql.err.ProgrammingError as e:
+                    # 1146 (table doesn't exist): no order tables, so nothing is open
+                    if e.args[0] == ER_NO_SUCH_TABLE:
+                        return set()
+                    raise
+                found.update(row[0] for row in cur.fetchall())
+        return found
     finally:
         conn.close()
 
 
-def search_products(filters: Dict, page: int, per_page: int = 10) -> Tuple[List[Dict], int]:
-    """Search with filters + pagination."""
+def product_has_open_orders(product_id: int) -> bool:
+    """Check for open orders referencing a product (see products_with_open_orders)."""
+    return product_id in products_with_open_orders([product_id])
+
+
+# Columns a search result row carries; description and image_url are left to
+# fetch_product, which still reads the whole row.
+_LIST_COLS = "product_id, SKU, title, category, price, quantity, archived, updated_at"
+
+
+# search_products filters as (mask bit, WHERE clause), in the order params are bound
+_SEARCH_SKU = 1 << 0
+_SEARCH_CATEGORY = 1 << 1
+_SEARCH_KEYWORD = 1 << 2
+_SEARCH_MIN_PRICE = 1 << 3
+_SEARCH_MAX_PRICE = 1 << 4
+_SEARCH_CLAUSES = (
+    (_SEARCH_SKU, "SKU LIKE %s"),
+    (_SEARCH_CATEGORY, "category = %s"),
+    (_SEARCH_KEYWORD, "(title LIKE %s OR description LIKE %s)"),
+    (_SEARCH_MIN_PRICE, "price >= %s"),
+    (_SEARCH_MAX_PRICE, "price <= %s"),
+)
+
+
+def _search_where(mask: int) -> str:
     where_clauses = ["archived = 0"]
+    where_clauses.extend(clause for bit, clause in _SEARCH_CLAUSES if mask & bit)
+    return " WHERE " + " AND ".join(where_clauses)
+
+
+@functools.lru_cache(maxsize=64)
+def _search_sql(mask: int) -> Tuple[str, str]:
+    """Return (count_sql, ids_sql) for the combination of filters set in mask."""
+    where_sql = _search_where(mask)
+    count_sql = f"SELECT COUNT(*) AS total FROM product{where_sql}"
+    ids_sql = f"""
+        SELECT product_id, COUNT(*) OVER() AS total FROM product
+        {where_sql}
+        ORDER BY updated_at DESC, product_id DESC
+        LIMIT %s OFFSET %s
+    """
+    return count_sql, ids_sql
+
+
+@functools.lru_cache(maxsize=32)
+def _keyset_sql(mask: int) -> str:
+    """Return the seek query for the page after a given (updated_at, product_id)."""
+    return f"""
+        SELECT {_LIST_COLS} FROM product
+        {_search_where(mask)} AND (updated_at, product_id) < (%s, %s)
+        ORDER BY updated_at DESC, product_id DESC
+        LIMIT %s
+    """
+
+
+def page_token(row: Dict) -> str:
+    """Encode the (updated_at, product_id) of a page's last row as an opaque token."""
+    raw = f"{row['updated_at'].isoformat()}|{row['product_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def parse_page_token(token: str) -> Tuple[datetime, int]:
+    """Decode a page_token() back into the `after` argument of search_products."""
+    updated_at, product_id = base64.urlsafe_b64decode(token.encode()).decode().split("|")
+    return datetime.fromisoformat(updated_at), int(product_id)
+
+
+@functools.lru_cache(maxsize=32)
+def _products_by_ids_sql(count: int) -> str:
+    """Return the SELECT that re-fetches `count` products by id, newest first."""
+    placeholders = ", ".join(["%s"] * count)
+    return f"""
+        SELECT {_LIST_COLS} FROM product
+        WHERE product_id IN ({placeholders})
+        ORDER BY updated_at DESC, product_id DESC
+    """
+
+
+def search_products(
+    filters: Dict,
+    page: int,
+    per_page: int = 10,
+    after: Optional[Tuple[datetime, int]] = None,
+) -> Tuple[List[Dict], int]:
+    """
+    Return (rows, total) for one page of active products matching filters, newest first.
+    `after` is the (updated_at, product_id) of the previous page's last row (see
+    parse_page_token); when given, the page after it is returned and `page` is ignored.
+    """
+    mask = 0
     params: List = []
 
     if filters.get("sku"):
-        where_clauses.append("SKU LIKE %s")
+        mask |= _SEARCH_SKU
         params.append(f"%{filters['sku']}%")
     if filters.get("category"):
-        where_clauses.append("category = %s")
+        mask |= _SEARCH_CATEGORY
         params.append(filters["category"])
     if filters.get("keyword"):
-        where_clauses.append("(title LIKE %s OR description LIKE %s)")
+        mask |= _SEARCH_KEYWORD
         kw = f"%{filters['keyword']}%"
         params.extend([kw, kw])
     if filters.get("min_price") is not None:
-        where_clauses.append("price >= %s")
+        mask |= _SEARCH_MIN_PRICE
         params.append(Decimal(filters["min_price"]))
     if filters.get("max_price") is not None:
-        where_clauses.append("price <= %s")
+        mask |= _SEARCH_MAX_PRICE
         params.append(Decimal(filters["max_price"]))
 
-    where_sql = " WHERE " + " AND ".join(where_clauses) if where_clauses else ""
+    count_sql, ids_sql = _search_sql(mask)
     offset = (page - 1) * per_page
 
     conn = get_db()
     try:
         with conn.cursor() as cur:
-            cur.execute(f"SELECT COUNT(*) AS total FROM product{where_sql}", params)
-            total = cur.fetchone().get("total", 0)
-
-            cur.execute(
-                f"""
-                SELECT * FROM product
-                {where_sql}
-                ORDER BY updated_at DESC
-                LIMIT %s OFFSET %s
-                """,
-                params + [per_page, offset],
-            )
+            if after is not None:
+                cur.execute(_keyset_sql(mask), params + [after[0], after[1], per_page])
+                rows = cur.fetchall()
+                cur.execute(count_sql, params)
+                return rows, cur.fetchone().get("total", 0)
+
+            # MySQL rejects LIMIT inside IN (subquery), so page ids are a separate query
+            cur.execute(ids_sql, params + [per_page, offset])
+            id_rows = cur.fetchall()
+            if not id_rows:
+                if offset == 0:
+                    return [], 0
+                # Past the last page there is no row to carry the total
+                cur.execute(count_sql, params)
+                return [], cur.fetchone().get("total", 0)
+
+            total = id_rows[0]["total"]
+            ids = [row["product_id"] for row in id_rows]
+
+            cur.execute(_products_by_ids_sql(len(ids)), ids)
             rows = cur.fetchall()
             return rows, total
     finally:
@@ -232,16 +630,20 @@ def search_products(filters: Dict, page: int, per_page: int = 10) -> Tuple[List[
 
 
 def inventory_value_by_category() -> List[Dict]:
-    """Return SUM(price * quantity) grouped by category."""
+    """
+    Return SUM(price * quantity) grouped by category.
+    Served from the category_inventory_value summary (one row per category),
+    which is created and backfilled on first use.
+    """
     conn = get_db()
     try:
+        _ensure_category_value(conn)
         with conn.cursor() as cur:
             cur.execute(
                 """
-                SELECT category, SUM(price * quantity) AS total_value
-                FROM product
-                WHERE archived = 0
-                GROUP BY category
+                SELECT NULLIF(category, '') AS category, total_value
+                FROM category_inventory_value
+                WHERE product_count > 0
                 ORDER BY category
                 """
             )
@@ -250,11 +652,18 @@ def inventory_value_by_category() -> List[Dict]:
         conn.close()
 
 
-def fetch_idle_stock(days: int) -> List[Dict]:
-    """Return products idle more than X days."""
+def fetch_idle_stock(days: int) -> Iterator[Dict]:
+    """
+    Yield products idle more than X days.
+    Rows are streamed from an unbuffered cursor, so a report can write each one out
+    as it arrives; use list(fetch_idle_stock(days)) where a list is needed.
+    The pooled connection is held until the generator is exhausted or closed.
+    """
     conn = get_db()
     try:
-        with conn.cursor() as cur:
+        # Closing the SS cursor reads off any unconsumed rows, so the connection
+        # goes back to the pool clean even if the caller stops early.
+        with conn.cursor(SSDictCursor) as cur:
             cur.execute(
                 """
                 SELECT
@@ -267,6 +676,114 @@ def fetch_idle_stock(days: int) -> List[Dict]:
                 """,
                 (days,),
             )
-            return cur.fetchall()
+            yield from cur
+    finally:
+        conn.close()
+
+
+def ensure_timestamp_defaults() -> bool:
+    """
+    Give product.created_at/updated_at server-side defaults if they lack them:
+    DEFAULT CURRENT_TIMESTAMP, plus ON UPDATE CURRENT_TIMESTAMP for updated_at.
+    Type, nullability and comment are restated as they are, since MODIFY
+    redefines the whole column. Returns True if the table was altered.
+    """
+    conn = get_db()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(_TIMESTAMP_COLUMNS_SQL, (DB_NAME,))
+            columns = {row["COLUMN_NAME"].lower(): row for row in cur.fetchall()}
+            if set(columns) != {"created_at", "updated_at"}:
+                return False
+            clauses, params = [], []
+            for name, on_update in (("created_at", False), ("updated_at", True)):
+                col = columns[name]
+                if col["DATA_TYPE"].lower() not in ("datetime", "timestamp"):
+                    return False
+                if col["COLUMN_DEFAULT"] and (
+                    not on_update or "on update" in col["EXTRA"].lower()
+                ):
+                    continue
+                # The default must carry the column's fractional-seconds precision
+                now = "CURRENT_TIMESTAMP"
+                if col["DATETIME_PRECISION"]:
+                    now += f"({col['DATETIME_PRECISION']})"
+                clause = f"MODIFY {name} {col['COLUMN_TYPE']}"
+                clause += " NOT NULL" if col["IS_NULLABLE"] == "NO" else " NULL"
+                clause += f" DEFAULT {now}"
+                if on_update:
+                    clause += f" ON UPDATE {now}"
+                if col["COLUMN_COMMENT"]:
+                    clause += " COMMENT %s"
+                    params.append(col["COLUMN_COMMENT"])
+                clauses.append(clause)
+            if not clauses:
+                return False
+            cur.execute("ALTER TABLE product " + ", ".join(clauses), params or None)
+            return True
     finally:
         conn.close()
+
+
+# (table, index name, columns, unique) for the query shapes above: the
+# archived/updated_at search and idle-stock scans, category totals, price history
+# per product, the open-orders join and SKU lookups. uq_product_sku comes last:
+# it fails while duplicate SKUs exist, and should not hold up the others.
+PRODUCT_INDEXES = (
+    ("product", "ix_product_archived_updated", "archived, updated_at, product_id", False),
+    ("product", "ix_product_archived_category", "archived, category", False),
+    ("pricehistory", "ix_pricehistory_product", "product_id, change_date", False),
+    ("order_items", "ix_order_items_product", "product_id", False),
+    ("product", "uq_product_sku", "SKU", True),
+)
+
+
+def ensure_indexes() -> List[str]:
+    """
+    Create any PRODUCT_INDEXES that are missing and return their names.
+    MySQL has no CREATE INDEX IF NOT EXISTS, so existing names are read from
+    information_schema first; tables that do not exist yet are skipped.
+    Raises RuntimeError if duplicate SKUs prevent uq_product_sku, since
+    DuplicateSKU is not enforced without it.
+    """
+    created = []
+    conn = get_db()
+    try:
+        tables = _tables(conn)
+        with conn.cursor(Cursor) as cur:
+            cur.execute(
+                "SELECT DISTINCT LOWER(INDEX_NAME) FROM information_schema.statistics "
+                "WHERE TABLE_SCHEMA = %s",
+                (DB_NAME,),
+            )
+            existing = {row[0] for row in cur.fetchall()}
+            for table, name, columns, unique in PRODUCT_INDEXES:
+                if table in tables and name not in existing:
+                    kind = "UNIQUE INDEX" if unique else "INDEX"
+                    try:
+                        cur.execute(f"CREATE {kind} {name} ON {table} ({columns})")
+                    except pymysql.err.IntegrityError as e:
+                        if unique and e.args[0] == ER_DUP_ENTRY:
+                            raise RuntimeError(
+                                f"{name} not created, {table} has duplicate values "
+                                f"({e.args[1]}); uniqueness is not enforced until they are fixed"
+                            ) from e
+                        raise
+                    created.append(name)
+    finally:
+        conn.close()
+    return created
+
+
+# Set PRODUCT_ENSURE_INDEXES=0 where the schema is managed separately
+if os.getenv("PRODUCT_ENSURE_INDEXES", "1") == "1":
+    try:
+        ensure_timestamp_defaults()
+        ensure_indexes()
+    except RuntimeError as e:
+        # Duplicate SKUs: the app runs, but DuplicateSKU is not raised until fixed
+        logger.error("product schema setup incomplete: %s", e)
+    except Exception as e:
+        # Never block import on this (DB down, pool exhausted, DDL refused); it is
+        # retried on the next start.
+        logger.warning("product schema setup skipped: %s", e)